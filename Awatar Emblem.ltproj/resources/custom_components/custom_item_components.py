@@ -26,6 +26,14 @@ class DoNothing(ItemComponent):
     expose = ComponentType.Int
     value = 1
 
+def ai_steal_priority(unit, target, move) -> float:
+    if target:
+        steal_term = 0.075
+        enemy_positions = utils.average_pos({other.position for other in game.units if other.position and skill_system.check_enemy(unit, other)})
+        distance_term = utils.calculate_distance(move, enemy_positions)
+        return steal_term + 0.01 * distance_term
+    return 0
+
 class StealFullInventoryWIP(ItemComponent):
     nid = 'steal_full_inventory'
     desc = "Steal any unequipped item from target on hit"
@@ -37,6 +45,9 @@ class StealFullInventoryWIP(ItemComponent):
     def init(self, item):
         item.data['target_item'] = None
 
+    def start_combat(self, playback, unit, item, target, item2, mode):
+        self._did_steal = False
+
     def target_restrict(self, unit, item, def_pos, splash) -> bool:
         # Unit has item that can be stolen
         attack = equations.parser.steal_atk(unit)
@@ -92,12 +103,7 @@ class StealFullInventoryWIP(ItemComponent):
         self._did_steal = False
 
     def ai_priority(self, unit, item, target, move):
-        if target:
-            steal_term = 0.075
-            enemy_positions = utils.average_pos({other.position for other in game.units if other.position and skill_system.check_enemy(unit, other)})
-            distance_term = utils.calculate_distance(move, enemy_positions)
-            return steal_term + 0.01 * distance_term
-        return 0
+        return ai_steal_priority(unit, target, move)
  
 class SuperEclipse(ItemComponent):
     nid = 'super_eclipse'
@@ -144,6 +150,9 @@ class StealCon(ItemComponent):
     def init(self, item):
         item.data['target_item'] = None
 
+    def start_combat(self, playback, unit, item, target, item2, mode):
+        self._did_steal = False
+
     def target_restrict(self, unit, item, def_pos, splash) -> bool:
         # Unit has item that can be stolen
         attack = equations.parser.steal_atk(unit)
@@ -175,7 +184,8 @@ class StealCon(ItemComponent):
             return False
         if def_item is defender.get_weapon():
             return False
-        if def_item.components.get('weight') and unit.get_stat('CON') < def_item.components.get('weight').value:
+        weight = def_item.components.get('weight')
+        if weight and unit.get_stat('CON') < weight.value:
             return False
         return True
 
@@ -198,12 +208,7 @@ class StealCon(ItemComponent):
         self._did_steal = False
 
     def ai_priority(self, unit, item, target, move):
-        if target:
-            steal_term = 0.075
-            enemy_positions = utils.average_pos({other.position for other in game.units if other.position and skill_system.check_enemy(unit, other)})
-            distance_term = utils.calculate_distance(move, enemy_positions)
-            return steal_term + 0.01 * distance_term
-        return 0
+        return ai_steal_priority(unit, target, move)
 
 class EvalMaximumRange(ItemComponent):
     nid = 'eval_max_range'
@@ -297,6 +302,34 @@ class DamageAny(ItemComponent):
             playback.append(pb.HitSound('No Damage'))
             playback.append(pb.HitAnim('MapNoDamage', target))
 
+# Forced movement helpers. Bounds and occupancy are checked before the
+# comparatively expensive movement cost lookup.
+def is_open_position(position) -> bool:
+    return game.board.check_bounds(position) and not game.board.get_unit(position)
+
+def is_passable(unit, position) -> bool:
+    # If we could pass through it if we had movement, allow the action to occur
+    return movement_funcs.get_mcost(unit, position) != 99 or \
+        99 <= equations.parser.movement(unit)
+
+def flexible_shove_position(unit_to_move, anchor_pos, magnitude):
+    # Furthest position up to magnitude spaces from anchor_pos, stopping at the first blocked tile
+    offset_x = utils.clamp(unit_to_move.position[0] - anchor_pos[0], -1, 1)
+    offset_y = utils.clamp(unit_to_move.position[1] - anchor_pos[1], -1, 1)
+    step = -1 if magnitude < 0 else 1
+    movement = equations.parser.movement(unit_to_move)
+    ret_position = None
+    for curr_magnitude in range(step, magnitude + step, step):
+        new_position = (unit_to_move.position[0] + offset_x * curr_magnitude,
+                        unit_to_move.position[1] + offset_y * curr_magnitude)
+        if not is_open_position(new_position) or \
+                movement_funcs.get_mcost(unit_to_move, new_position) > movement:
+            break
+        ret_position = new_position
+    if not ret_position:
+        return False
+    return ret_position
+
 class ShoveOnEndCombatInitiate(ItemComponent):
     nid = 'shove_on_end_combat_initiate'
     desc = "Item shoves target at the end of combat, only on initiation"
@@ -311,13 +344,7 @@ class ShoveOnEndCombatInitiate(ItemComponent):
         new_position = (unit_to_move.position[0] + offset_x * magnitude,
                         unit_to_move.position[1] + offset_y * magnitude)
 
-        mcost = movement_funcs.get_mcost(unit_to_move, new_position)
-        #If we could pass through it if we had movement, allow the action to occur
-        if mcost != 99:
-            mcost = 0
-        if game.board.check_bounds(new_position) and \
-                not game.board.get_unit(new_position) and \
-                mcost <= equations.parser.movement(unit_to_move):
+        if is_open_position(new_position) and is_passable(unit_to_move, new_position):
             return new_position
         return False
     
@@ -336,28 +363,7 @@ class ShoveFlexibleOnEndCombatInitiate(ItemComponent):
     value = 1
 
     def _check_shove(self, unit_to_move, anchor_pos, magnitude):
-        curr_magnitude = 0
-        ret_position = None
-        while(abs(curr_magnitude) < abs(magnitude)):
-            if magnitude < 0:
-                curr_magnitude -= 1
-            else:
-                curr_magnitude += 1
-            offset_x = utils.clamp(unit_to_move.position[0] - anchor_pos[0], -1, 1)
-            offset_y = utils.clamp(unit_to_move.position[1] - anchor_pos[1], -1, 1)
-            new_position = (unit_to_move.position[0] + offset_x * curr_magnitude,
-                            unit_to_move.position[1] + offset_y * curr_magnitude)
-
-            mcost = movement_funcs.get_mcost(unit_to_move, new_position)
-            if game.board.check_bounds(new_position) and \
-                    not game.board.get_unit(new_position) and \
-                    mcost <= equations.parser.movement(unit_to_move):
-                ret_position = new_position
-            else:
-                magnitude = 0
-        if not ret_position:
-            return False
-        return ret_position
+        return flexible_shove_position(unit_to_move, anchor_pos, magnitude)
     
     def end_combat(self, playback, unit, item, target, item2, mode):
         if target and not skill_system.ignore_forced_movement(target) and mode and mode == 'attack':
@@ -386,6 +392,9 @@ class EvalHPCost(ItemComponent):
     def available(self, unit, item) -> bool:
         return unit.get_hp() > self._check_value(unit, item)
 
+    def start_combat(self, playback, unit, item, target, item2, mode):
+        self._did_something = False
+
     def on_hit(self, actions, playback, unit, item, target, item2, target_pos, mode, attack_info):
         self._did_something = True
 
@@ -411,28 +420,7 @@ class ShoveFlexibleStops(ItemComponent):
     value = 1
 
     def _check_shove(self, unit_to_move, anchor_pos, magnitude):
-        curr_magnitude = 0
-        ret_position = None
-        while(abs(curr_magnitude) < abs(magnitude)):
-            if magnitude < 0:
-                curr_magnitude -= 1
-            else:
-                curr_magnitude += 1
-            offset_x = utils.clamp(unit_to_move.position[0] - anchor_pos[0], -1, 1)
-            offset_y = utils.clamp(unit_to_move.position[1] - anchor_pos[1], -1, 1)
-            new_position = (unit_to_move.position[0] + offset_x * curr_magnitude,
-                            unit_to_move.position[1] + offset_y * curr_magnitude)
-
-            mcost = movement_funcs.get_mcost(unit_to_move, new_position)
-            if game.board.check_bounds(new_position) and \
-                    not game.board.get_unit(new_position) and \
-                    mcost <= equations.parser.movement(unit_to_move):
-                ret_position = new_position
-            else:
-                magnitude = 0
-        if not ret_position:
-            return False
-        return ret_position
+        return flexible_shove_position(unit_to_move, anchor_pos, magnitude)
 
     def on_hit(self, actions, playback, unit, item, target, item2, target_pos, mode, attack_info):
         if target and not skill_system.ignore_forced_movement(target):
@@ -484,7 +472,14 @@ class StatusesAfterCombatOnHit(ItemComponent):
 
     expose = (ComponentType.List, ComponentType.Skill)  # Nid
 
-    _did_hit = set()
+    def __init__(self, value=None):
+        super().__init__(value)
+        # Targets hit this combat. Kept per instance, since a class level set
+        # would be shared by every unit holding an item with this component
+        self._did_hit = set()
+
+    def start_combat(self, playback, unit, item, target, item2, mode):
+        self._did_hit = set()
 
     def on_hit(self, actions, playback, unit, item, target, item2, target_pos, mode, attack_info):
         self._did_hit.add(target)
@@ -537,10 +532,15 @@ class EvalEnemyBlastAOE(ItemComponent):
         from app.engine import skill_system
         ranges = set(range(self._get_power(unit)))
         splash = game.target_system.find_manhattan_spheres(ranges, position[0], position[1])
-        splash = {pos for pos in splash if game.tilemap.check_bounds(pos)}
-        # Doesn't highlight allies positions
-        splash = {pos for pos in splash if not game.board.get_unit(pos) or skill_system.check_enemy(unit, game.board.get_unit(pos))}
-        return splash
+        positions = set()
+        for pos in splash:
+            if not game.tilemap.check_bounds(pos):
+                continue
+            # Doesn't highlight allies positions
+            other = game.board.get_unit(pos)
+            if not other or skill_system.check_enemy(unit, other):
+                positions.add(pos)
+        return positions
 
 class SelfUnloadUnit(ItemComponent):
     nid = 'self_unload_unit'
@@ -613,13 +613,7 @@ class PivotOnEndCombatInitiate(ItemComponent):
         new_position = (anchor_pos[0] + offset_x * -magnitude,
                         anchor_pos[1] + offset_y * -magnitude)
 
-        mcost = movement_funcs.get_mcost(unit_to_move, new_position)
-        #If we could pass through it if we had movement, allow the action to occur
-        if mcost != 99:
-            mcost = 0
-        if game.board.check_bounds(new_position) and \
-                not game.board.get_unit(new_position) and \
-                mcost <= equations.parser.movement(unit_to_move):
+        if is_open_position(new_position) and is_passable(unit_to_move, new_position):
             return new_position
         return False
     
@@ -656,9 +650,8 @@ class Backdash(ItemComponent):
         offset = utils.tmult(utils.tclamp(utils.tuple_sub(upos, tpos), (-1, -1), (1, 1)), magnitude)
         npos = utils.tuple_add(upos, offset)
 
-        mcost_user = movement_funcs.get_mcost(user, npos)
-        if game.board.check_bounds(npos) and not game.board.get_unit(npos) and \
-                mcost_user <= equations.parser.movement(user):
+        if is_open_position(npos) and \
+                movement_funcs.get_mcost(user, npos) <= equations.parser.movement(user):
             return npos
         return None
 
@@ -694,16 +687,8 @@ class DrawBackOnEndCombatInitiate(ItemComponent):
         new_position_target = (target.position[0] - offset_x * magnitude,
                                target.position[1] - offset_y * magnitude)
 
-        mcost_user = movement_funcs.get_mcost(user, new_position_user)
-        mcost_target = movement_funcs.get_mcost(target, new_position_target)
-        #If we could pass through it if we had movement, allow the action to occur
-        if mcost_user != 99:
-            mcost_user = 0
-        if mcost_target != 99:
-            mcost_target = 0
-        if game.board.check_bounds(new_position_user) and \
-                not game.board.get_unit(new_position_user) and \
-                mcost_user <= equations.parser.movement(user) and mcost_target <= equations.parser.movement(target):
+        if is_open_position(new_position_user) and \
+                is_passable(user, new_position_user) and is_passable(target, new_position_target):
             return new_position_user, new_position_target
         return None, None
     
@@ -807,6 +792,20 @@ class EvalDamage(ItemComponent):
             playback.append(pb.HitSound('No Damage'))
             playback.append(pb.HitAnim('MapNoDamage', target))
 
+def ai_status_priority(unit, target, item, move, status_nids) -> float:
+    # Only worth using if the target is missing at least one of the statuses
+    if target and not set(status_nids).issubset({skill.nid for skill in target.skills}):
+        accuracy_term = utils.clamp(combat_calcs.compute_hit(unit, target, item, target.get_weapon(), "attack", (0, 0))/100., 0, 1)
+        num_attacks = combat_calcs.outspeed(unit, target, item, target.get_weapon(), "attack", (0, 0))
+        accuracy_term *= num_attacks
+        # Tries to maximize distance from target
+        distance_term = 0.01 * utils.calculate_distance(move, target.position)
+        if skill_system.check_enemy(unit, target):
+            return 0.5 * accuracy_term + distance_term
+        else:
+            return -0.5 * accuracy_term
+    return 0
+
 def ai_status_priority_buff(unit, target, item, move, status_nid) -> float:
     if target and status_nid not in [skill.nid for skill in target.skills]:
         accuracy_term = utils.clamp(combat_calcs.compute_hit(unit, target, item, target.get_weapon(), "attack", (0, 0))/100., 0, 1)
@@ -969,13 +968,7 @@ class PivotAlwaysOnEndCombatInitiate(ItemComponent):
         new_position = (anchor_pos[0] + offset_x * -magnitude,
                         anchor_pos[1] + offset_y * -magnitude)
 
-        mcost = movement_funcs.get_mcost(unit_to_move, new_position)
-        #If we could pass through it if we had movement, allow the action to occur
-        if mcost != 99:
-            mcost = -999
-        if game.board.check_bounds(new_position) and \
-                not game.board.get_unit(new_position) and \
-                mcost <= equations.parser.movement(unit_to_move):
+        if is_open_position(new_position) and is_passable(unit_to_move, new_position):
             return new_position
         return False
     
@@ -993,7 +986,7 @@ class EvalWeight(ItemComponent):
     expose = ComponentType.String
     value = 0
 
-    def modify_attack_speed(self, unit, item):
+    def _excess_weight(self, unit, item) -> int:
         from app.engine import evaluate
         try:
             new_value = int(evaluate.evaluate(self.value, unit, local_args={'item': item}))
@@ -1001,27 +994,16 @@ class EvalWeight(ItemComponent):
             logging.error("EVAL WEIGHT: Couldn't evaluate %s conditional (%s)", self.value, e)
             new_value = 0
 
-        return -1 * max(0, new_value - equations.parser.constitution(unit))
+        return max(0, new_value - equations.parser.constitution(unit))
 
-    def modify_defense_speed(self, unit, item):
-        from app.engine import evaluate
-        try:
-            new_value = int(evaluate.evaluate(self.value, unit, local_args={'item': item}))
-        except Exception as e:
-            logging.error("EVAL WEIGHT: Couldn't evaluate %s conditional (%s)", self.value, e)
-            new_value = 0
+    def modify_attack_speed(self, unit, item):
+        return -1 * self._excess_weight(unit, item)
 
-        return -1 * max(0, new_value - equations.parser.constitution(unit))
+    def modify_defense_speed(self, unit, item):
+        return -1 * self._excess_weight(unit, item)
 
     def modify_avoid(self, unit, item):
-        from app.engine import evaluate
-        try:
-            new_value = int(evaluate.evaluate(self.value, unit, local_args={'item': item}))
-        except Exception as e:
-            logging.error("EVAL WEIGHT: Couldn't evaluate %s conditional (%s)", self.value, e)
-            new_value = 0
-
-        return -2 * max(0, new_value - equations.parser.constitution(unit))
+        return -2 * self._excess_weight(unit, item)
 
 class Unavailable(ItemComponent):
     nid = 'unavailable'
@@ -1042,10 +1024,14 @@ class RestoreAfterCombat(ItemComponent):
         return status.negative
 
     def end_combat(self, playback, unit, item, target, item2, mode):
-        for skill in target.all_skills[:]:
-            if self._can_be_restored(skill):
-                actions.append(action.RemoveSkill(target, skill))
-                playback.append(pb.RestoreHit(unit, item, target))
+        if not target:
+            return
+        statuses = [skill for skill in target.all_skills if self._can_be_restored(skill)]
+        for skill in statuses:
+            action.do(action.RemoveSkill(target, skill))
+        # One brush for the whole restore, not one per status
+        if statuses:
+            playback.append(pb.RestoreHit(unit, item, target))
 
 class StackCost(ItemComponent):
     nid = 'stack_cost'
@@ -1094,29 +1080,39 @@ class MapAttackVoice(ItemComponent):
 
     author = 'Beccarte'
 
+    # Number of attack voice clips per '<unit nid>Attack' prefix, so the sfx
+    # list is only scanned the first time a unit attacks rather than on every
+    # strike. Cleared whenever the number of sfx changes (e.g. clips added
+    # and resources reloaded during editor test-play).
+    _voice_counts = {}
+    _voice_counts_sfx_len = None
+    # Voice choice is purely cosmetic and depends on the combat_voices setting,
+    # so it draws from its own generator rather than the shared one
+    _voice_random = random.Random()
+
+    def _play_voice(self, unit):
+        sound_name = unit.nid + 'Attack'
+        if MapAttackVoice._voice_counts_sfx_len != len(RESOURCES.sfx):
+            MapAttackVoice._voice_counts_sfx_len = len(RESOURCES.sfx)
+            self._voice_counts.clear()
+        if sound_name not in self._voice_counts:
+            #Get the unit's list of attack voice clips.
+            self._voice_counts[sound_name] = len([i for i in RESOURCES.sfx.keys() if sound_name in i])
+        num_sounds = self._voice_counts[sound_name]
+        #Randomly determine which voice clip to play.
+        if num_sounds > 0:
+            sound = sound_name + str(self._voice_random.randint(1, num_sounds))
+            get_sound_thread().play_sfx(sound)
+
     def on_hit(self, actions, playback, unit, item, target, item2, target_pos, mode, attack_info):
         #Determine whether to play a voice clip depending on game options.
         if unit and cf.SETTINGS['combat_voices']:
-            #Get the unit's list of attack voice clips.
-            sound_list = RESOURCES.sfx.keys()
-            sound_name = unit.nid + 'Attack'
-            unit_sounds = [i for i in sound_list if sound_name in i]
-            #Randomly determine which voice clip to play.
-            if len(unit_sounds) > 0:
-                sound = sound_name + str(random.randint(1, len(unit_sounds)))
-                get_sound_thread().play_sfx(sound)
+            self._play_voice(unit)
 
     def on_miss(self, actions, playback, unit, item, target, item2, target_pos, mode, attack_info):
         #Determine whether to play a voice clip depending on game options.
         if unit and cf.SETTINGS['combat_voices']:
-            #Get the unit's list of attack voice clips.
-            sound_list = RESOURCES.sfx.keys()
-            sound_name = unit.nid + 'Attack'
-            unit_sounds = [i for i in sound_list if sound_name in i]
-            #Randomly determine which voice clip to play.
-            if len(unit_sounds) > 0:
-                sound = sound_name + str(random.randint(1, len(unit_sounds)))
-                get_sound_thread().play_sfx(sound)
+            self._play_voice(unit)
 
 class RestoreNoRestriction(ItemComponent):
     nid = 'restore_no_restriction'
@@ -1127,10 +1123,12 @@ class RestoreNoRestriction(ItemComponent):
         return status.negative
 
     def on_hit(self, actions, playback, unit, item, target, item2, target_pos, mode, attack_info):
-        for skill in target.all_skills[:]:
-            if self._can_be_restored(skill):
-                actions.append(action.RemoveSkill(target, skill))
-                playback.append(pb.RestoreHit(unit, item, target))
+        statuses = [skill for skill in target.all_skills if self._can_be_restored(skill)]
+        for skill in statuses:
+            actions.append(action.RemoveSkill(target, skill))
+        # One brush for the whole restore, not one per status
+        if statuses:
+            playback.append(pb.RestoreHit(unit, item, target))
 
 class MultiDescSkill(ItemComponent):
     nid = 'multi_desc_skill'
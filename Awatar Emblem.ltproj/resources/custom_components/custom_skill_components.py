@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from typing import Dict
 from app.data.database.components import ComponentType
 from app.data.database.database import DB
 from app.data.database.skill_components import SkillComponent, SkillTags
@@ -72,6 +73,12 @@ class LostOnTakeHit(SkillComponent):
         if target and skill_system.check_enemy(unit, target) and strike == Strike.HIT:
             action.do(action.RemoveSkill(unit, self.skill))
 
+def trigger_event(event_nid, unit, target, position, local_args):
+    # Without an event set, the event manager would look up and log a missing
+    # event every time the component fires
+    if event_nid:
+        game.events.trigger_specific_event(event_nid, unit, target, position, local_args)
+
 class EventOnTakeHit(SkillComponent):
     nid = 'event_stack_on_take_hit'
     desc = "An event procs when receiving an attack (it must hit)"
@@ -82,7 +89,7 @@ class EventOnTakeHit(SkillComponent):
 
     def after_take_strike(self, actions, playback, unit, item, target, item2, mode, attack_info, strike):
         if target and skill_system.check_enemy(unit, target) and strike == Strike.HIT:
-            game.events.trigger_specific_event(self.value, unit, unit, unit.position, {'item': None, 'mode': None})
+            trigger_event(self.value, unit, unit, unit.position, {'item': None, 'mode': None})
         
 class LostOnStrike(SkillComponent):
     nid = 'lost_on_strike'
@@ -162,7 +169,7 @@ class UpkeepEvent(SkillComponent):
     value = ''
 
     def on_upkeep(self, actions, playback, unit):
-        game.events.trigger_specific_event(self.value, unit, unit, unit.position, {'item': None, 'mode': None})
+        trigger_event(self.value, unit, unit, unit.position, {'item': None, 'mode': None})
 
 class EndstepEvent(SkillComponent):
     nid = 'endstep_event'
@@ -173,7 +180,7 @@ class EndstepEvent(SkillComponent):
     value = ''
 
     def on_endstep(self, actions, playback, unit):
-        game.events.trigger_specific_event(self.value, unit, unit, unit.position, {'item': None, 'mode': None})
+        trigger_event(self.value, unit, unit, unit.position, {'item': None, 'mode': None})
 
 class CritEvent(SkillComponent):
     nid = 'crit_event'
@@ -186,7 +193,7 @@ class CritEvent(SkillComponent):
     def end_combat(self, playback, unit, item, target, item2, mode):
         mark_playbacks = [p for p in playback if p.nid in ('mark_crit')]
         if target and any(p.attacker is unit for p in mark_playbacks):
-            game.events.trigger_specific_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
+            trigger_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
 
 class UpkeepSkillGain(SkillComponent):
     nid = 'upkeep_skill_gain'
@@ -218,46 +225,54 @@ class LostOnEndNextCombat(SkillComponent):
 
     value = [["NumberOfCombats (X)", "2", 'Number of combats before expiration'],["LostOnSelf (T/F)", "T", 'Lost after self combat (e.g. vulnerary)'],["LostOnAlly (T/F)", "T", 'Lost after combat with an ally'],["LostOnEnemy (T/F)", "T", 'Lost after combat with an enemy'],["LostOnSplash (T/F)", "T", 'Lost after combat if using an AOE item']]
 
+    _parsed_value = None
+
     def init(self, skill):
-        self.skill.data['combats'] = self.values.get('NumberOfCombats (X)', '2')
+        self._parse_values()
+        self.skill.data['combats'] = self._num_combats
 
     @property
     def values(self) -> Dict[str, str]:
         return {value[0]: value[1] for value in self.value}
 
+    def _parse_values(self):
+        # Options are only re-parsed when the value list itself is replaced.
+        # Missing entries fall back to the defaults, which covers values
+        # saved before an option was added.
+        if self._parsed_value is self.value:
+            return
+        values = self.values
+        try:
+            self._num_combats = int(values.get('NumberOfCombats (X)', '2'))
+        except ValueError:
+            logging.error("LostOnEndNextCombat: invalid number of combats %s", values.get('NumberOfCombats (X)'))
+            self._num_combats = 2
+        self._lost_on_self = values.get('LostOnSelf (T/F)', 'T') == 'T'
+        self._lost_on_ally = values.get('LostOnAlly (T/F)', 'T') == 'T'
+        self._lost_on_enemy = values.get('LostOnEnemy (T/F)', 'T') == 'T'
+        self._lost_on_splash = values.get('LostOnSplash (T/F)', 'T') == 'T'
+        self._parsed_value = self.value
+
     def post_combat(self, playback, unit, item, target, item2, mode):
         from app.engine import skill_system
-        remove_skill = False
-        if self.values.get('LostOnSelf (T/F)', 'T') == 'T':
-            if unit == target:
-                val = int(self.skill.data['combats']) - 1
-                action.do(action.SetObjData(self.skill, 'combats', val))
-                if int(self.skill.data['combats']) <= 0:
-                    remove_skill = True
-
-        if self.values.get('LostOnAlly (T/F)', 'T') == 'T':
-            if target:
-                if skill_system.check_ally(unit, target):
-                    val = int(self.skill.data['combats']) - 1
-                    action.do(action.SetObjData(self.skill, 'combats', val))
-                    if int(self.skill.data['combats']) <= 0:
-                        remove_skill = True
-        if self.values.get('LostOnEnemy (T/F)', 'T') == 'T':
-            if target:
-                if skill_system.check_enemy(unit, target):
-                    val = int(self.skill.data['combats']) - 1
-                    action.do(action.SetObjData(self.skill, 'combats', val))
-                    if int(self.skill.data['combats']) <= 0:
-                        remove_skill = True
-        if self.values.get('LostOnSplash (T/F)', 'T') == 'T':
-            if not target:
-                val = int(self.skill.data['combats']) - 1
-                action.do(action.SetObjData(self.skill, 'combats', val))
-                if int(self.skill.data['combats']) <= 0:
-                    remove_skill = True
-
-        if remove_skill:
-            action.do(action.RemoveSkill(unit, self.skill))
+        self._parse_values()
+        # Count every matching rule first so the skill data is only written once
+        combats_used = 0
+        if self._lost_on_self and unit == target:
+            combats_used += 1
+        if self._lost_on_ally and target and skill_system.check_ally(unit, target):
+            combats_used += 1
+        if self._lost_on_enemy and target and skill_system.check_enemy(unit, target):
+            combats_used += 1
+        if self._lost_on_splash and not target:
+            combats_used += 1
+
+        if combats_used:
+            # Skills saved before this was stored as an int hold a string
+            val = int(self.skill.data['combats']) - combats_used
+            action.do(action.SetObjData(self.skill, 'combats', val))
+            if val <= 0:
+                action.do(action.RemoveSkill(unit, self.skill))
 
     def on_end_chapter(self, unit, skill):
         action.do(action.RemoveSkill(unit, self.skill))
@@ -289,10 +304,17 @@ class UndamagedCondition(SkillComponent):
     def condition(self, unit):
         return not self.skill.data['_has_taken_damage']
 
+    def start_combat(self, playback, unit, item, target, item2, mode):
+        self._took_damage_this_combat = False
+
     def after_take_strike(self, actions, playback, unit, item, target, item2, mode, attack_info, strike):
         for act in reversed(actions):
             if isinstance(act, action.ChangeHP) and act.num < 0 and act.unit == unit:
-                self._took_damage_this_combat = True
+                if item is None and target is None:
+                    # Upkeep damage, outside of any combat, so record it now
+                    action.do(action.SetObjData(self.skill, '_has_taken_damage', True))
+                else:
+                    self._took_damage_this_combat = True
                 break
 
     def end_combat(self, playback, unit, item, target, item2, mode):
@@ -330,6 +352,42 @@ class HealOnKill(SkillComponent):
             heal = self.value
             action.do(action.ChangeHP(unit, heal))
 
+# Picking a hit sound variant is cosmetic, so by default it does not advance
+# the seeded game RNG
+_upkeep_sound_random = random.Random()
+
+def upkeep_hp_playback(playback, unit, hp_change, randint=_upkeep_sound_random.randint):
+    # Adds the map brushes for an upkeep HP change. A unit's upkeep brushes
+    # all play at the same time, so the same sound or heal animation is only
+    # added once no matter how many statuses change its HP.
+    def has_sound(prefix) -> bool:
+        return any(isinstance(brush, pb.HitSound) and brush.sound.startswith(prefix) for brush in playback)
+
+    def has_anim(name) -> bool:
+        return any(isinstance(brush, pb.CastAnim) and brush.anim == name for brush in playback)
+
+    if hp_change < 0:
+        # Roll even when deduped, so a seeded randint is drawn the same way.
+        # Any variant of the hit sound counts, since they would all play at once
+        sound = 'Attack Hit ' + str(randint(1, 5))
+        if not has_sound('Attack Hit '):
+            playback.append(pb.HitSound(sound))
+        if not any(isinstance(brush, pb.UnitTintAdd) for brush in playback):
+            playback.append(pb.UnitTintAdd(unit, (255, 255, 255)))
+        playback.append(pb.DamageNumbers(unit, -hp_change))
+    elif hp_change > 0:
+        if not has_sound('MapHeal'):
+            playback.append(pb.HitSound('MapHeal'))
+        if hp_change >= 30:
+            name = 'MapBigHealTrans'
+        elif hp_change >= 15:
+            name = 'MapMediumHealTrans'
+        else:
+            name = 'MapSmallHealTrans'
+        if not has_anim(name):
+            playback.append(pb.CastAnim(name))
+        playback.append(pb.DamageNumbers(unit, -hp_change))
+
 class EvalRegeneration(SkillComponent):
     nid = 'eval_regeneration'
     desc = "Unit restores HP at beginning of turn, based on the given evaluation"
@@ -346,18 +404,11 @@ class EvalRegeneration(SkillComponent):
             except:
                 logging.error("Couldn't evaluate %s conditional" % self.value)
                 hp_change = 0
+            if hp_change == 0:
+                return  # Nothing to show, so don't hold up the phase on this unit
             actions.append(action.ChangeHP(unit, hp_change))
             if hp_change > 0:
-                # Playback
-                playback.append(pb.HitSound('MapHeal'))
-                playback.append(pb.DamageNumbers(unit, -hp_change))
-                if hp_change >= 30:
-                    name = 'MapBigHealTrans'
-                elif hp_change >= 15:
-                    name = 'MapMediumHealTrans'
-                else:
-                    name = 'MapSmallHealTrans'
-                playback.append(pb.CastAnim(name))
+                upkeep_hp_playback(playback, unit, hp_change)
 
 class CannotUseItemsOnEnemy(SkillComponent):
     nid = 'cannot_use_items_enemy'
@@ -376,7 +427,7 @@ class EventAfterKill(SkillComponent):
 
     def end_combat(self, playback, unit, item, target, item2, mode):
         if target and target.get_hp() <= 0:
-            game.events.trigger_specific_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
+            trigger_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
             action.do(action.TriggerCharge(unit, self.skill))
             
 class EventBeforeCombat(SkillComponent):
@@ -388,74 +439,46 @@ class EventBeforeCombat(SkillComponent):
     value = ''
 
     def start_combat(self, playback, unit, item, target, item2, mode):
-        game.events.trigger_specific_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
+        trigger_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
         
 class PermanentDamage(SkillComponent):
     nid = 'permanent_damage'
     desc = 'All damage taken is dealt to max HP'
     tag = SkillTags.CUSTOM
-    
-    def after_strike(self, actions, playback, unit, item, target, item2, mode, attack_info, strike):
-        stat_changes = {}
-        if unit.get_max_hp() > int(unit._fields['Undeath_Current_HP']):
-            for i in range(unit.get_max_hp() - int(unit._fields['Undeath_Current_HP'])):
+
+    def _sync_max_hp(self, unit):
+        # Each stat change gets its own dict, since the action keeps a
+        # reference to it for the turnwheel
+        current_max_hp = int(unit._fields['Undeath_Current_HP'])
+        max_hp = unit.get_max_hp()
+        if max_hp > current_max_hp:
+            for i in range(max_hp - current_max_hp):
                 action.do(action.AddSkill(unit, 'Undying_Will'))
-            stat_changes['HP'] = int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp()
+            stat_changes = {'HP': current_max_hp - unit.get_max_hp()}
             action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        elif unit.get_max_hp() < int(unit._fields['Undeath_Current_HP']):
-            action.do(action.RemoveSkill(unit, 'Undying_Will', count=(int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp())))
-            stat_changes['HP'] = min(int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp(), len([skill.nid for skill in unit.skills if skill.nid == 'Undying_Will']) - unit.get_max_hp())
+        elif max_hp < current_max_hp:
+            action.do(action.RemoveSkill(unit, 'Undying_Will', count=(current_max_hp - max_hp)))
+            stat_changes = {'HP': min(current_max_hp - unit.get_max_hp(), len([skill.nid for skill in unit.skills if skill.nid == 'Undying_Will']) - unit.get_max_hp())}
             action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        stat_changes['HP'] = max(unit.get_hp() - unit.get_max_hp(), 1 - unit.get_max_hp())
-        action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        action.do(action.ChangeField(unit, key='Undeath_Current_HP', value=unit.get_max_hp()))
+        max_hp = unit.get_max_hp()
+        hp_change = max(unit.get_hp() - max_hp, 1 - max_hp)
+        if hp_change:
+            action.do(action.ApplyStatChanges(unit, {'HP': hp_change}, False))
+            max_hp = unit.get_max_hp()
+        if int(unit._fields['Undeath_Current_HP']) != max_hp:
+            action.do(action.ChangeField(unit, key='Undeath_Current_HP', value=max_hp))
+
+    def after_strike(self, actions, playback, unit, item, target, item2, mode, attack_info, strike):
+        self._sync_max_hp(unit)
 
     def after_take_strike(self, actions, playback, unit, item, target, item2, mode, attack_info, strike):
-        stat_changes = {}
-        if unit.get_max_hp() > int(unit._fields['Undeath_Current_HP']):
-            for i in range(unit.get_max_hp() - int(unit._fields['Undeath_Current_HP'])):
-                action.do(action.AddSkill(unit, 'Undying_Will'))
-            stat_changes['HP'] = int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp()
-            action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        elif unit.get_max_hp() < int(unit._fields['Undeath_Current_HP']):
-            action.do(action.RemoveSkill(unit, 'Undying_Will', count=(int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp())))
-            stat_changes['HP'] = min(int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp(), len([skill.nid for skill in unit.skills if skill.nid == 'Undying_Will']) - unit.get_max_hp())
-            action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        stat_changes['HP'] = max(unit.get_hp() - unit.get_max_hp(), 1 - unit.get_max_hp())
-        action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        action.do(action.ChangeField(unit, key='Undeath_Current_HP', value=unit.get_max_hp()))
-        
+        self._sync_max_hp(unit)
+
     def cleanup_combat(self, playback, unit, item, target, item2, mode):
-        stat_changes = {}
-        if unit.get_max_hp() > int(unit._fields['Undeath_Current_HP']):
-            for i in range(unit.get_max_hp() - int(unit._fields['Undeath_Current_HP'])):
-                action.do(action.AddSkill(unit, 'Undying_Will'))
-            stat_changes['HP'] = int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp()
-            action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        elif unit.get_max_hp() < int(unit._fields['Undeath_Current_HP']):
-            action.do(action.RemoveSkill(unit, 'Undying_Will', count=(int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp())))
-            stat_changes['HP'] = min(int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp(), len([skill.nid for skill in unit.skills if skill.nid == 'Undying_Will']) - unit.get_max_hp())
-            action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        stat_changes['HP'] = max(unit.get_hp() - unit.get_max_hp(), 1 - unit.get_max_hp())
-        action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        action.do(action.ChangeField(unit, key='Undeath_Current_HP', value=unit.get_max_hp()))
-        
+        self._sync_max_hp(unit)
+
     def end_combat(self, playback, unit, item, target, item2, mode):
-        print(unit.get_max_hp())
-        print(int(unit._fields['Undeath_Current_HP']))
-        stat_changes = {}
-        if unit.get_max_hp() > int(unit._fields['Undeath_Current_HP']):
-            for i in range(unit.get_max_hp() - int(unit._fields['Undeath_Current_HP'])):
-                action.do(action.AddSkill(unit, 'Undying_Will'))
-            stat_changes['HP'] = int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp()
-            action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        elif unit.get_max_hp() < int(unit._fields['Undeath_Current_HP']):
-            action.do(action.RemoveSkill(unit, 'Undying_Will', count=(int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp())))
-            stat_changes['HP'] = min(int(unit._fields['Undeath_Current_HP']) - unit.get_max_hp(), len([skill.nid for skill in unit.skills if skill.nid == 'Undying_Will']) - unit.get_max_hp())
-            action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        stat_changes['HP'] = max(unit.get_hp() - unit.get_max_hp(), 1 - unit.get_max_hp())
-        action.do(action.ApplyStatChanges(unit, stat_changes, False))
-        action.do(action.ChangeField(unit, key='Undeath_Current_HP', value=unit.get_max_hp()))
+        self._sync_max_hp(unit)
 
 class EvalUpkeepDamageNonFatal(SkillComponent):
     nid = 'eval_upkeep_damage_non_fatal'
@@ -464,23 +487,6 @@ class EvalUpkeepDamageNonFatal(SkillComponent):
 
     expose = ComponentType.String
 
-    def _playback_processing(self, playback, unit, hp_change):
-        # Playback
-        if hp_change < 0:
-            playback.append(pb.HitSound('Attack Hit ' + str(static_random.get_randint(1, 5))))
-            playback.append(pb.UnitTintAdd(unit, (255, 255, 255)))
-            playback.append(pb.DamageNumbers(unit, abs(hp_change)))
-        elif hp_change > 0:
-            playback.append(pb.HitSound('MapHeal'))
-            if hp_change >= 30:
-                name = 'MapBigHealTrans'
-            elif hp_change >= 15:
-                name = 'MapMediumHealTrans'
-            else:
-                name = 'MapSmallHealTrans'
-            playback.append(pb.CastAnim(name))
-            playback.append(pb.DamageNumbers(unit, abs(hp_change)))
-
     def on_upkeep(self, actions, playback, unit):
         from app.engine import evaluate
         try:
@@ -505,9 +511,14 @@ class EvalUpkeepDamageNonFatal(SkillComponent):
 
         # Let other enemies die — full damage applies if not protected
 
-        actions.append(action.ChangeHP(unit, hp_change))
+        # A zero change still builds charge and fires take-strike hooks, but
+        # has nothing to apply or show
+        if hp_change != 0:
+            actions.append(action.ChangeHP(unit, hp_change))
         actions.append(action.TriggerCharge(unit, self.skill))
-        self._playback_processing(playback, unit, hp_change)
+        # This status has always drawn its sound from static_random, so keep
+        # doing so to leave the roll sequence of existing saves unchanged
+        upkeep_hp_playback(playback, unit, hp_change, static_random.get_randint)
         skill_system.after_take_strike(actions, playback, unit, None, None, None, 'defense', (0, 0), Strike.HIT)
 
 class CopySafe(SkillComponent):
@@ -526,7 +537,7 @@ class EventAfterCombat(SkillComponent):
     value = ''
 
     def end_combat(self, playback, unit: UnitObject, item, target: UnitObject, item2, mode):
-        game.events.trigger_specific_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
+        trigger_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
         
 class AbilityAttackCharge(SkillComponent):
     nid = 'ability_attack_charge'
@@ -585,7 +596,8 @@ class ActiveCombatChargeIncrease(SkillComponent):
         if not self.skill.data.get('active') and target and any(p.attacker is unit and (p.main_attacker is unit or p.attacker is p.main_attacker.strike_partner) for p in mark_playbacks):
             new_value = self.skill.data['charge'] + self.value
             new_value = min(new_value, self.skill.data['total_charge'])
-            action.do(action.SetObjData(self.skill, 'charge', new_value))
+            if new_value != self.skill.data['charge']:
+                action.do(action.SetObjData(self.skill, 'charge', new_value))
             
 class AdditionalInventory(SkillComponent):
     nid = 'additional_inventory'
@@ -753,6 +765,7 @@ class AttackProcWithTarget(SkillComponent):
     _did_action = False
 
     def start_sub_combat(self, actions, playback, unit, item, target, item2, mode, attack_info):
+        self._did_action = False
         if mode == 'attack' and target and skill_system.check_enemy(unit, target):
             if not get_weapon_filter(self.skill, unit, item):
                 return
@@ -779,6 +792,7 @@ class DefenseProcWithTarget(SkillComponent):
     _did_action = False
 
     def start_sub_combat(self, actions, playback, unit, item, target, item2, mode, attack_info):
+        self._did_action = False
         if mode == 'defense' and target and skill_system.check_enemy(unit, target):
             if not get_weapon_filter(self.skill, unit, item):
                 return
@@ -801,6 +815,26 @@ class CombatArtProc(SkillComponent):
     desc = "Skill is procced from a Combat Art."
     tag = SkillTags.CUSTOM
 
+def aoe_skill_targets(unit, options) -> list:
+    # Units that an upkeep/endstep AoE skill gain with these options reaches from unit
+    targets = []
+    if unit.position:
+        affect_enemies = options.get('target') in ('enemy', 'any')
+        affect_allies = options.get('target') in ('ally', 'any')
+        r = set(range(options.get('range') + 1))
+        locations = game.target_system.get_shell({unit.position}, r, game.board.bounds)
+        for loc in locations:
+            target2 = game.board.get_unit(loc)
+            if not target2 or target2 is unit:
+                continue
+            if affect_enemies and skill_system.check_enemy(unit, target2):
+                targets.append(target2)
+            elif affect_allies and skill_system.check_ally(unit, target2):
+                targets.append(target2)
+    if options.get('affect_self'):
+        targets.append(unit)
+    return targets
+
 class UpkeepAOESkillGain(SkillComponent):
     nid = 'upkeep_aoe_skill_gain'
     desc = "Grants the designated skill at upkeep to units in an AoE around owner. Can optionally affect user as well."
@@ -826,17 +860,8 @@ class UpkeepAOESkillGain(SkillComponent):
             self.value.update(value)
 
     def on_upkeep(self, actions, playback, unit):
-        r = set(range(self.value.get('range') + 1))
-        locations = game.target_system.get_shell({unit.position}, r, game.board.bounds)
-        for loc in locations:
-            target2 = game.board.get_unit(loc)
-            if target2 and target2 is not unit and self.value.get('target') in ['enemy','any'] and skill_system.check_enemy(unit, target2):
-                action.do(action.AddSkill(target2, self.value.get('skill'), unit))
-            elif target2 and target2 is not unit and self.value.get('target') in ['ally','any'] and skill_system.check_ally(unit, target2):
-                action.do(action.AddSkill(target2, self.value.get('skill'), unit))
-
-        if self.value.get('affect_self'):
-            action.do(action.AddSkill(unit, self.value.get('skill'), unit))
+        for target2 in aoe_skill_targets(unit, self.value):
+            action.do(action.AddSkill(target2, self.value.get('skill'), unit))
 
 class EndstepAOESkillGain(SkillComponent):
     nid = 'endstep_aoe_skill_gain'
@@ -863,17 +888,8 @@ class EndstepAOESkillGain(SkillComponent):
             self.value.update(value)
 
     def on_endstep(self, actions, playback, unit):
-        r = set(range(self.value.get('range') + 1))
-        locations = game.target_system.get_shell({unit.position}, r, game.board.bounds)
-        for loc in locations:
-            target2 = game.board.get_unit(loc)
-            if target2 and target2 is not unit and self.value.get('target') in ['enemy','any'] and skill_system.check_enemy(unit, target2):
-                action.do(action.AddSkill(target2, self.value.get('skill'), unit))
-            elif target2 and target2 is not unit and self.value.get('target') in ['ally','any'] and skill_system.check_ally(unit, target2):
-                action.do(action.AddSkill(target2, self.value.get('skill'), unit))
-
-        if self.value.get('affect_self'):
-            action.do(action.AddSkill(unit, self.value.get('skill'), unit))
+        for target2 in aoe_skill_targets(unit, self.value):
+            action.do(action.AddSkill(target2, self.value.get('skill'), unit))
 
 class FatalDamage(SkillComponent):
     nid = 'fatal_damage'
@@ -893,6 +909,11 @@ class TrueMiracleEvent(SkillComponent):
     expose = ComponentType.Event
     value = ''
 
+    _event_triggered = False
+
+    def start_combat(self, playback, unit, item, target, item2, mode):
+        self._event_triggered = False
+
     def after_take_strike(self, actions, playback, unit, item, target, item2, mode, attack_info, strike):
         did_something = False
         for act in reversed(actions):
@@ -903,7 +924,19 @@ class TrueMiracleEvent(SkillComponent):
 
         if did_something:
             actions.append(action.TriggerCharge(unit, self.skill))
-            game.events.trigger_specific_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
+            # Only one event per combat, even if several strikes would have been
+            # lethal. Upkeep damage also calls this hook, with no item or target,
+            # and always triggers the event.
+            in_combat = item is not None or target is not None
+            if in_combat and self._event_triggered:
+                logging.debug("%s: coalesced repeat trigger of event %s", self.skill.nid, self.value)
+            else:
+                if in_combat:
+                    self._event_triggered = True
+                trigger_event(self.value, unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
+
+    def end_combat(self, playback, unit, item, target, item2, mode):
+        self._event_triggered = False
 
 class GiveStatusesOnTakeHit(SkillComponent):
     nid = 'give_statuses_on_take_hit'
@@ -947,7 +980,8 @@ class KillChargeIncrease(SkillComponent):
         if not self.skill.data.get('active') and target and target.get_hp() <= 0:
             new_value = self.skill.data['charge'] + self.value
             new_value = min(new_value, self.skill.data['total_charge'])
-            action.do(action.SetObjData(self.skill, 'charge', new_value))
+            if new_value != self.skill.data['charge']:
+                action.do(action.SetObjData(self.skill, 'charge', new_value))
 
 class NullSweep(SkillComponent):
     nid = 'null_sweep'
@@ -1138,11 +1172,11 @@ class StartAndEndEventInitiate(SkillComponent):
 
     def start_combat(self, playback, unit, item, target, item2, mode):
         if mode == 'attack':
-            game.events.trigger_specific_event(self.value.get('start_event'), unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
+            trigger_event(self.value.get('start_event'), unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
     
     def end_combat(self, playback, unit: UnitObject, item, target: UnitObject, item2, mode):
         if mode == 'attack':
-            game.events.trigger_specific_event(self.value.get('end_event'), unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
+            trigger_event(self.value.get('end_event'), unit, target, unit.position, {'item': item, 'item2': item2, 'mode': mode})
 
 class BetterPostCombatDamage(SkillComponent):
     nid = 'better_post_combat_damage'
@@ -1193,7 +1227,8 @@ class CombatChargeIncreaseBetter(SkillComponent):
         if unit and target and not self.skill.data.get('active') and skill_system.check_enemy(unit, target):
             new_value = self.skill.data['charge'] + self.value
             new_value = min(new_value, self.skill.data['total_charge'])
-            action.do(action.SetObjData(self.skill, 'charge', new_value))
+            if new_value != self.skill.data['charge']:
+                action.do(action.SetObjData(self.skill, 'charge', new_value))
 
 class GiveStatusesAfterCombat(SkillComponent):
     nid = 'give_statuses_after_combat'
@@ -1235,7 +1270,9 @@ class DrainChargeAll(SkillComponent):
         combined_parties = game.get_all_units_in_party() + game.get_all_units_in_party('Flex')
         for ally in combined_parties:
             if ally.nid != unit.nid and self.skill.nid in [s.nid for s in ally.skills]:
-                action.do(action.SetObjData(ally.get_skill(self.skill.nid), 'charge', new_value))
+                ally_skill = ally.get_skill(self.skill.nid)
+                if ally_skill.data['charge'] != new_value:
+                    action.do(action.SetObjData(ally_skill, 'charge', new_value))
 
     def text(self) -> str:
         return str(self.skill.data['charge'])
@@ -1641,23 +1678,6 @@ class UpkeepDamageNonFatal(SkillComponent):
     expose = ComponentType.Int
     value = 5
 
-    def _playback_processing(self, playback, unit, hp_change):
-        # Playback
-        if hp_change < 0:
-            playback.append(pb.HitSound('Attack Hit ' + str(random.randint(1, 5))))
-            playback.append(pb.UnitTintAdd(unit, (255, 255, 255)))
-            playback.append(pb.DamageNumbers(unit, self.value))
-        elif hp_change > 0:
-            playback.append(pb.HitSound('MapHeal'))
-            if hp_change >= 30:
-                name = 'MapBigHealTrans'
-            elif hp_change >= 15:
-                name = 'MapMediumHealTrans'
-            else:
-                name = 'MapSmallHealTrans'
-            playback.append(pb.CastAnim(name))
-            playback.append(pb.DamageNumbers(unit, self.value))
-
     def on_upkeep(self, actions, playback, unit):
         # Determine whether the unit is protected from death
         is_protected = unit.team == 'player' or 'Boss' in unit.tags
@@ -1677,7 +1697,7 @@ class UpkeepDamageNonFatal(SkillComponent):
 
         actions.append(action.ChangeHP(unit, hp_change))
         actions.append(action.TriggerCharge(unit, self.skill))
-        self._playback_processing(playback, unit, hp_change)
+        upkeep_hp_playback(playback, unit, hp_change)
         skill_system.after_take_strike(actions, playback, unit, None, None, None, 'defense', (0, 0), Strike.HIT)
 
 class MultiDescSkill(SkillComponent):
@@ -1716,4 +1736,5 @@ class EndstepChargeIncrease(SkillComponent):
     def on_endstep(self, actions, playback, unit):
         new_value = self.skill.data['charge'] + self.value
         new_value = utils.clamp(new_value, 0, self.skill.data['total_charge'])
-        action.do(action.SetObjData(self.skill, 'charge', new_value))
\ No newline at end of file
+        if new_value != self.skill.data['charge']:
+            action.do(action.SetObjData(self.skill, 'charge', new_value))
\ No newline at end of file